@@ -7,15 +7,25 @@ from flask import Flask, render_template, jsonify, request
 import os
 import gzip
 import shutil
-import tempfile
+import io
+import threading
 import paramiko
 from datetime import datetime, timedelta
 from google.cloud import storage
 import re
+import stat
+import posixpath
 import logging
-from typing import List, Dict, Optional
+import time
+from typing import List, Dict, Optional, Tuple
 import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from async_transfer import AsyncTransferEngine
+except ImportError:  # asyncssh/aiohttp son opcionales, solo para el motor asíncrono
+    AsyncTransferEngine = None
 
 app = Flask(__name__)
 
@@ -35,15 +45,274 @@ GCP_CONFIG = {
     'service_account_path': 'service-account.json'  # Ruta al archivo de credenciales
 }
 
+PROCESSING_CONFIG = {
+    'daily_rollup': False,                  # Combinar los archivos de cada día en un solo objeto
+    'rollup_keep_originals': True,          # Conservar también los objetos individuales
+    'rollup_object_name': 'diario_{date}.csv',
+    'rollup_max_workers': 4,                # Días combinados en paralelo
+    'stats_file': 'transfer_stats.json',    # Rendimiento medido para estimar duración
+    'stats_max_runs': 10,
+    'plan_isize_sample_per_day': 20,        # Lecturas ISIZE por día en el plan (se extrapola el resto)
+    'temp_directory': './temp',             # Spool en disco para archivos grandes
+    'keep_local_files': False,              # Conservar los CSV descomprimidos en temp_directory
+    'memory_budget_mb': 256,                # RAM máxima para archivos en vuelo
+    'disk_budget_mb': 2048,                 # Disco máximo para archivos en vuelo
+    'spill_threshold_mb': 16,               # Archivos mayores van a disco
+    'min_free_disk_mb': 512,                # Espacio libre mínimo a preservar
+    'upload_workers': 4,
+    'transfer_engine': 'threads',           # 'threads' o 'async' (muchos archivos pequeños)
+    'async_sftp_sessions': 4,               # Sesiones SFTP multiplexadas del motor asíncrono
+    'async_max_in_flight': 256,             # Archivos simultáneos en el motor asíncrono
+    'async_http_connections': 64,
+    'async_upload_retries': 3,
+    'async_max_file_mb': 4,                 # Tamaño comprimido máximo para el motor asíncrono
+    'discovery_mode': 'full',               # 'full' o 'incremental' (marca de agua por mtime)
+    'discovery_state_file': 'discovery_state.json',
+    'date_subdirectory_format': None,       # p. ej. '%Y%m%d' o '%Y/%m/%d' para listar solo esos días
+    'recursive_discovery': False,           # Recorrer subdirectorios anidados
+    'discovery_max_depth': 5
+}
+
+# Límite de objetos fuente por operación compose de GCS
+COMPOSE_MAX_SOURCES = 32
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONFIG_FILE = 'config_web.json'
+
+def load_processing_config():
+    """Aplicar la sección 'processing' de config_web.json sobre los valores por defecto"""
+    if not os.path.exists(CONFIG_FILE):
+        return
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+        PROCESSING_CONFIG.update(config.get('processing', {}))
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️  No se pudo leer {CONFIG_FILE}: {str(e)}")
+
+load_processing_config()
+
+class SpoolError(Exception):
+    """No hay presupuesto ni espacio en disco para continuar la transferencia"""
+
+
+class SpoolEntry:
+    """Archivo descomprimido retenido en memoria o en disco hasta subirlo"""
+    
+    def __init__(self, name: str, reserved: int, path: Optional[str] = None, spill_path: Optional[str] = None):
+        self.name = name
+        self.reserved = reserved
+        self.reserved_in_memory = path is None
+        self.path = path
+        self.spill_path = spill_path or path
+        self.data = b''
+        self.size = 0
+        # Tamaño comprimido del archivo remoto, para medir el rendimiento real
+        self.source_size = 0
+    
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+    
+    def write_from(self, source, chunk_size: int = 1024 * 1024):
+        """Copiar el contenido de un stream al almacenamiento de la entrada"""
+        if self.in_memory:
+            buffer = io.BytesIO()
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                if buffer.tell() + len(chunk) > self.reserved:
+                    # ISIZE subestimó el tamaño (es módulo 2^32): continuar en disco
+                    self.path = self.spill_path
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    with open(self.path, 'wb') as local_file:
+                        with buffer.getbuffer() as written:
+                            local_file.write(written)
+                        buffer = None
+                        local_file.write(chunk)
+                        shutil.copyfileobj(source, local_file, chunk_size)
+                    self.size = os.path.getsize(self.path)
+                    logger.info(f"💾 {self.name} superó su reserva en memoria, se pasa a disco")
+                    return
+                buffer.write(chunk)
+            # getvalue() entrega el buffer interno ya ajustado, sin copiarlo
+            self.data = buffer.getvalue()
+            self.size = len(self.data)
+        else:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'wb') as local_file:
+                shutil.copyfileobj(source, local_file, chunk_size)
+            self.size = os.path.getsize(self.path)
+    
+    def open(self):
+        """Abrir la entrada para lectura"""
+        if self.in_memory:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+    
+    def read_header(self) -> bytes:
+        """Leer la primera línea (cabecera CSV)"""
+        with self.open() as f:
+            return f.readline()
+
+
+class SpoolManager:
+    """Controla los presupuestos de RAM y disco de los archivos en vuelo"""
+    
+    def __init__(self, directory: str, memory_budget: int, disk_budget: int,
+                 spill_threshold: int, min_free_disk: int, keep_local_files: bool = False):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.spill_threshold = spill_threshold
+        self.min_free_disk = min_free_disk
+        self.keep_local_files = keep_local_files
+        self.memory_used = 0
+        self.disk_used = 0
+        self.entries = []
+        self.condition = threading.Condition()
+    
+    @classmethod
+    def from_config(cls) -> 'SpoolManager':
+        """Crear el spool con los valores de PROCESSING_CONFIG"""
+        mb = 1024 * 1024
+        return cls(
+            directory=PROCESSING_CONFIG['temp_directory'],
+            memory_budget=PROCESSING_CONFIG['memory_budget_mb'] * mb,
+            disk_budget=PROCESSING_CONFIG['disk_budget_mb'] * mb,
+            spill_threshold=PROCESSING_CONFIG['spill_threshold_mb'] * mb,
+            min_free_disk=PROCESSING_CONFIG['min_free_disk_mb'] * mb,
+            keep_local_files=PROCESSING_CONFIG['keep_local_files']
+        )
+    
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.check_free_space(0, raise_error=True)
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+        return False
+    
+    def check_free_space(self, needed: int, raise_error: bool = False) -> bool:
+        """Verificar que queda espacio libre en disco tras escribir `needed` bytes"""
+        free = shutil.disk_usage(self.directory).free
+        if free - needed >= self.min_free_disk:
+            return True
+        if raise_error:
+            raise SpoolError(
+                f"Espacio libre insuficiente en {self.directory}: "
+                f"{free // (1024 * 1024)} MB disponibles, mínimo {self.min_free_disk // (1024 * 1024)} MB"
+            )
+        return False
+    
+    def local_path(self, name: str) -> str:
+        """Ruta local de una entrada; los nombres relativos (día/archivo) conservan sus carpetas"""
+        return os.path.join(self.directory, *name.split('/'))
+    
+    def try_reserve(self, name: str, expected_size: int, allow_disk: bool = True) -> Optional[SpoolEntry]:
+        """Intentar reservar sin esperar; devuelve None si el presupuesto está lleno"""
+        with self.condition:
+            entry = None
+            # Un archivo mayor que el presupuesto se admite solo si no hay otros en vuelo
+            fits_memory = self.memory_used + expected_size <= self.memory_budget or self.memory_used == 0
+            if not allow_disk:
+                if fits_memory:
+                    entry = SpoolEntry(name, expected_size)
+            elif not self.keep_local_files and expected_size <= self.spill_threshold and fits_memory:
+                entry = SpoolEntry(name, expected_size, spill_path=self.local_path(name))
+            else:
+                fits_disk = self.disk_used + expected_size <= self.disk_budget or self.disk_used == 0
+                if fits_disk and self.check_free_space(expected_size):
+                    entry = SpoolEntry(name, expected_size, self.local_path(name))
+                elif not self.entries:
+                    # Nada en vuelo que pueda liberar espacio
+                    self.check_free_space(expected_size, raise_error=True)
+            
+            if entry is None:
+                return None
+            if entry.reserved_in_memory:
+                self.memory_used += expected_size
+            else:
+                self.disk_used += expected_size
+            self.entries.append(entry)
+            return entry
+    
+    def reserve(self, name: str, expected_size: int) -> SpoolEntry:
+        """Reservar presupuesto para un archivo, esperando si el spool está lleno"""
+        with self.condition:
+            waiting = False
+            while True:
+                entry = self.try_reserve(name, expected_size)
+                if entry is not None:
+                    return entry
+                if not waiting:
+                    logger.info(f"⏳ Presupuesto de spool lleno, esperando para descargar {name}")
+                    waiting = True
+                self.condition.wait(timeout=5)
+    
+    def commit(self, entry: SpoolEntry):
+        """Ajustar la reserva al tamaño real una vez escrito el archivo"""
+        with self.condition:
+            if entry.reserved_in_memory:
+                self.memory_used -= entry.reserved
+            else:
+                self.disk_used -= entry.reserved
+            # La entrada pudo pasar de memoria a disco durante la escritura
+            if entry.in_memory:
+                self.memory_used += entry.size
+            else:
+                self.disk_used += entry.size
+            entry.reserved = entry.size
+            entry.reserved_in_memory = entry.in_memory
+            self.condition.notify_all()
+    
+    def release(self, entry: SpoolEntry):
+        """Liberar la entrada y su presupuesto"""
+        with self.condition:
+            if entry not in self.entries:
+                return
+            self.entries.remove(entry)
+            if entry.reserved_in_memory:
+                self.memory_used -= entry.reserved
+            else:
+                self.disk_used -= entry.reserved
+            entry.data = b''
+            if entry.path and not self.keep_local_files and os.path.exists(entry.path):
+                os.remove(entry.path)
+                self.remove_empty_directories(os.path.dirname(entry.path))
+            self.condition.notify_all()
+    
+    def remove_empty_directories(self, directory: str):
+        """Borrar las carpetas de día que quedaron vacías, sin tocar el directorio del spool"""
+        root = os.path.abspath(self.directory)
+        directory = os.path.abspath(directory)
+        while directory != root and directory.startswith(root + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+    
+    def cleanup(self):
+        """Liberar todas las entradas pendientes (también tras errores)"""
+        for entry in list(self.entries):
+            try:
+                self.release(entry)
+            except OSError as e:
+                logger.warning(f"⚠️  No se pudo eliminar temporal {entry.name}: {str(e)}")
+
+
 class TransferManager:
     def __init__(self):
         self.sftp_client = None
         self.gcp_client = None
         self.bucket = None
+        self.pending_discovery_state = None
         
     def connect_gcp(self):
         """Conectar a Google Cloud Storage"""
@@ -69,7 +338,11 @@ class TransferManager:
                 # Extraer fecha del nombre del archivo
                 # Asumir formato: archivo_YYYYMMDD.csv o similar
                 filename = blob.name.split('/')[-1]
-                date_match = re.search(r'(\d{8})', filename)  # YYYYMMDD
+                # Archivos sin fecha en el nombre se suben bajo una carpeta YYYYMMDD
+                relative_name = blob.name[len(GCP_CONFIG['destination_folder']):]
+                if relative_name.startswith('_rollup_tmp/'):
+                    continue
+                date_match = re.search(r'(\d{8})', filename) or re.search(r'(\d{8})', relative_name)  # YYYYMMDD
                 if date_match:
                     date_str = date_match.group(1)
                     try:
@@ -105,92 +378,670 @@ class TransferManager:
             logger.error(f"❌ Error conectando SFTP: {str(e)}")
             return False
     
-    def get_files_to_download(self, start_date: datetime, end_date: datetime) -> List[str]:
-        """Obtener lista de archivos a descargar desde SFTP"""
-        try:
-            # Cambiar al directorio remoto
-            self.sftp_client.chdir(SFTP_CONFIG['remote_directory'])
-            all_files = self.sftp_client.listdir()
+    def iter_remote_entries(self, directory: str, watermark: Optional[Dict], start_str: str, depth: int = 0):
+        """Recorrer un directorio remoto en streaming, sin construir el listado completo"""
+        recursive = PROCESSING_CONFIG['recursive_discovery']
+        watermark_mtime = watermark['mtime'] if watermark else None
+        subdirectories = []
+        
+        for attr in self.sftp_client.listdir_iter(directory):
+            path = attr.filename if directory == '.' else posixpath.join(directory, attr.filename)
             
-            files_to_download = []
-            current_date = start_date
+            if stat.S_ISDIR(attr.st_mode or 0):
+                if not recursive or depth >= PROCESSING_CONFIG['discovery_max_depth']:
+                    continue
+                # El mtime de un directorio no refleja cambios en sus subdirectorios, así que
+                # solo se podan carpetas de día (YYYYMMDD) anteriores al rango
+                if re.fullmatch(r'\d{8}', attr.filename) and attr.filename < start_str:
+                    continue
+                subdirectories.append(path)
+                continue
             
-            while current_date <= end_date:
-                date_str = current_date.strftime('%Y%m%d')
-                
-                # Buscar archivos que contengan esta fecha
-                for file in all_files:
-                    if date_str in file and file.endswith('.gz'):
-                        files_to_download.append(file)
-                        
-                current_date += timedelta(days=1)
+            # Filtrar por la marca de agua a medida que llegan las entradas
+            if watermark_mtime is not None:
+                mtime = attr.st_mtime or 0
+                if mtime < watermark_mtime or (mtime == watermark_mtime and path in watermark['names']):
+                    continue
+            
+            attr.filename = path
+            yield attr
+        
+        # listdir_iter deja lecturas adelantadas en el canal: no se puede anidar otro listado
+        for path in subdirectories:
+            yield from self.iter_remote_entries(path, watermark, start_str, depth + 1)
+    
+    def get_remote_files_by_date(self, start_date: datetime, end_date: datetime,
+                                 use_watermark: bool = True) -> Dict[str, List[paramiko.SFTPAttributes]]:
+        """Obtener archivos remotos agrupados por fecha, listando solo lo necesario"""
+        # Cambiar al directorio remoto
+        self.sftp_client.chdir(SFTP_CONFIG['remote_directory'])
+        
+        # Un rango explícito (backfill) lista todo el rango, sin marca de agua
+        incremental = use_watermark and PROCESSING_CONFIG['discovery_mode'] == 'incremental'
+        state = load_discovery_state() if incremental else {}
+        subdirectory_format = PROCESSING_CONFIG['date_subdirectory_format']
+        
+        dates = []
+        current_date = start_date
+        while current_date <= end_date:
+            dates.append(current_date)
+            current_date += timedelta(days=1)
+        
+        # Con subdirectorios por fecha se listan directamente los días del rango
+        if subdirectory_format:
+            roots = [(current_date.strftime(subdirectory_format), current_date.strftime('%Y%m%d'))
+                     for current_date in dates]
+        else:
+            roots = [('.', None)]
+        date_strs = [current_date.strftime('%Y%m%d') for current_date in dates]
+        start_str = start_date.strftime('%Y%m%d')
+        
+        files_by_date = {}
+        new_state = dict(state)
+        for root, root_date in roots:
+            selected = []
+            history = []
+            pending = []
+            try:
+                for attr in self.iter_remote_entries(root, state.get(root), start_str):
+                    if not attr.filename.endswith('.gz'):
+                        continue
+                    
+                    # Buscar la fecha del rango que contiene el nombre del archivo
+                    date_str = root_date or next(
+                        (d for d in date_strs if d in posixpath.basename(attr.filename)), None
+                    )
+                    if date_str:
+                        attr.object_name = self.get_object_name(attr.filename, root, root_date)
+                        files_by_date.setdefault(date_str, []).append(attr)
+                        selected.append(attr)
+                        continue
+                    
+                    # Lo posterior al rango debe volver a aparecer en la próxima ejecución.
+                    # Lo anterior es historia, igual que lo que no tiene fecha en el nombre:
+                    # aquí nunca se selecciona y no debe frenar la marca de agua
+                    file_date = re.search(r'(\d{8})', posixpath.basename(attr.filename))
+                    if file_date and file_date.group(1) >= start_str:
+                        pending.append(attr)
+                    else:
+                        history.append(attr)
+            except FileNotFoundError:
+                logger.info(f"📂 Directorio remoto inexistente, se omite: {root}")
+                continue
+            
+            if incremental:
+                watermark = advance_watermark(state.get(root), selected + history, pending)
+                if watermark:
+                    new_state[root] = watermark
+        
+        # La marca de agua solo se guarda tras una transferencia exitosa
+        self.pending_discovery_state = new_state if incremental else None
+        
+        total = sum(len(attrs) for attrs in files_by_date.values())
+        mode = 'incremental' if incremental else 'completo'
+        logger.info(f"🔎 Descubrimiento {mode}: {total} archivos en {len(roots)} directorio(s)")
+        return files_by_date
+    
+    @staticmethod
+    def get_object_name(path: str, root: str, root_date: Optional[str]) -> str:
+        """Nombre del CSV en el bucket (y en el spool), relativo a remote_directory.
+        Con carpetas por fecha se antepone el día (YYYYMMDD/archivo.csv): archivos con el
+        mismo nombre en días distintos no se pisan y get_last_upload_date encuentra la fecha"""
+        if root_date:
+            path = posixpath.join(root_date, posixpath.relpath(path, root))
+        return path.replace('.gz', '')
+    
+    def commit_discovery_state(self):
+        """Persistir la marca de agua calculada en el último descubrimiento"""
+        if self.pending_discovery_state is not None:
+            save_discovery_state(self.pending_discovery_state)
+            self.pending_discovery_state = None
+    
+    def get_files_to_download(self, start_date: datetime, end_date: datetime,
+                              use_watermark: bool = True) -> Dict[str, List[paramiko.SFTPAttributes]]:
+        """Obtener los archivos a descargar desde SFTP, agrupados por fecha"""
+        try:
+            files_by_date = self.get_remote_files_by_date(start_date, end_date, use_watermark)
             
-            logger.info(f"📁 Archivos encontrados para descargar: {len(files_to_download)}")
-            return files_to_download
+            logger.info(f"📁 Archivos encontrados para descargar: {sum(len(attrs) for attrs in files_by_date.values())}")
+            return files_by_date
             
         except Exception as e:
             logger.error(f"❌ Error obteniendo archivos SFTP: {str(e)}")
-            return []
+            return {}
+    
+    def read_gzip_isize(self, attr: paramiko.SFTPAttributes, remote_file=None) -> Optional[int]:
+        """Leer el tamaño descomprimido (ISIZE) de los últimos 4 bytes del .gz remoto"""
+        if not attr.st_size or attr.st_size < 18:  # Menor que cabecera + trailer gzip
+            return None
+        try:
+            if remote_file is not None:
+                remote_file.seek(attr.st_size - 4)
+                trailer = remote_file.read(4)
+            else:
+                with self.sftp_client.open(attr.filename, 'rb') as remote_file:
+                    remote_file.seek(attr.st_size - 4)
+                    trailer = remote_file.read(4)
+            # ISIZE es el tamaño original módulo 2^32, en little-endian
+            return int.from_bytes(trailer, 'little')
+        except Exception as e:
+            logger.warning(f"⚠️  No se pudo leer ISIZE de {attr.filename}: {str(e)}")
+            return None
+    
+    def build_transfer_plan(self, start_date: datetime, end_date: datetime, use_watermark: bool = True) -> Dict:
+        """Construir el plan de transferencia sin descargar ni subir archivos"""
+        files_by_date = self.get_remote_files_by_date(start_date, end_date, use_watermark)
+        
+        days = []
+        totals = {'files': 0, 'compressed_bytes': 0, 'decompressed_bytes': 0}
+        sample_size = PROCESSING_CONFIG['plan_isize_sample_per_day']
+        for date_str, attrs in sorted(files_by_date.items()):
+            compressed = sum(attr.st_size or 0 for attr in attrs)
+            
+            # Leer ISIZE solo de una muestra repartida en el día: cada lectura es un
+            # open/seek/read remoto y hay días con miles de archivos
+            step = max(1, len(attrs) // sample_size)
+            sample = attrs[::step][:sample_size]
+            sampled_compressed = 0
+            sampled_decompressed = 0
+            for attr in sample:
+                isize = self.read_gzip_isize(attr)
+                if isize is not None:
+                    sampled_compressed += attr.st_size
+                    sampled_decompressed += isize
+            
+            if sampled_compressed:
+                # Extrapolar con la razón de compresión observada en la muestra
+                ratio = sampled_decompressed / sampled_compressed
+                decompressed = sampled_decompressed + round((compressed - sampled_compressed) * ratio)
+            else:
+                # Sin ISIZE se asume el tamaño comprimido como cota inferior
+                decompressed = compressed
+            
+            days.append({
+                'date': datetime.strptime(date_str, '%Y%m%d').strftime('%Y-%m-%d'),
+                'files': len(attrs),
+                'compressed_bytes': compressed,
+                'decompressed_bytes': decompressed,
+                'isize_sampled': len(sample)
+            })
+            totals['files'] += len(attrs)
+            totals['compressed_bytes'] += compressed
+            totals['decompressed_bytes'] += decompressed
+        
+        throughput = get_recent_throughput()
+        estimated_seconds = None
+        if throughput and totals['files']:
+            # Con muchos archivos pequeños domina el costo por archivo, no los bytes
+            by_bytes = totals['compressed_bytes'] / throughput['bytes_per_second']
+            by_files = totals['files'] / throughput['files_per_second'] if throughput['files_per_second'] else 0
+            estimated_seconds = round(max(by_bytes, by_files))
+        
+        logger.info(f"🗺️ Plan: {totals['files']} archivos, {totals['compressed_bytes']} bytes comprimidos")
+        return {
+            'days': days,
+            'totals': totals,
+            'throughput': throughput,
+            'estimated_seconds': estimated_seconds
+        }
     
-    def download_and_decompress(self, files: List[str], temp_dir: str) -> List[str]:
-        """Descargar y descomprimir archivos"""
-        decompressed_files = []
+    def download_to_spool(self, attr: paramiko.SFTPAttributes, spool: SpoolManager) -> SpoolEntry:
+        """Descargar y descomprimir un archivo directamente al spool"""
+        csv_filename = attr.object_name
         
-        for file in files:
+        with self.sftp_client.open(attr.filename, 'rb') as remote_file:
+            # Reservar según el tamaño descomprimido declarado en el trailer gzip;
+            # ISIZE es módulo 2^32, así que nunca se reserva menos que el comprimido
+            isize = self.read_gzip_isize(attr, remote_file)
+            expected_size = max(isize or 0, attr.st_size or 0)
+            entry = spool.reserve(csv_filename, expected_size)
+            entry.source_size = attr.st_size or 0
+            
             try:
-                # Descargar archivo .gz
-                local_gz_path = os.path.join(temp_dir, file)
-                self.sftp_client.get(file, local_gz_path)
-                logger.info(f"📥 Descargado: {file}")
-                
-                # Descomprimir archivo
-                csv_filename = file.replace('.gz', '')
-                local_csv_path = os.path.join(temp_dir, csv_filename)
-                
-                with gzip.open(local_gz_path, 'rb') as gz_file:
-                    with open(local_csv_path, 'wb') as csv_file:
-                        shutil.copyfileobj(gz_file, csv_file)
-                
-                logger.info(f"📦 Descomprimido: {csv_filename}")
-                decompressed_files.append(local_csv_path)
-                
-                # Eliminar archivo .gz temporal
-                os.remove(local_gz_path)
-                
-            except Exception as e:
-                logger.error(f"❌ Error procesando archivo {file}: {str(e)}")
-                continue
+                remote_file.seek(0)
+                remote_file.prefetch(attr.st_size)
+                with gzip.GzipFile(fileobj=remote_file, mode='rb') as gz_file:
+                    entry.write_from(gz_file)
+                spool.commit(entry)
+            except Exception:
+                spool.release(entry)
+                raise
         
-        return decompressed_files
+        location = 'memoria' if entry.in_memory else 'disco'
+        logger.info(f"📥 Descargado y descomprimido en {location}: {csv_filename}")
+        return entry
     
-    def upload_to_gcp(self, local_files: List[str]) -> Dict[str, int]:
+    def upload_to_gcp(self, entries: List[SpoolEntry]) -> Dict[str, int]:
         """Subir archivos a GCP"""
-        results = {'success': 0, 'failed': 0, 'uploaded_files': []}
+        results = {'success': 0, 'failed': 0, 'uploaded_files': [], 'transferred_bytes': 0}
         
-        for local_file in local_files:
+        for entry in entries:
             try:
-                filename = os.path.basename(local_file)
-                destination_path = GCP_CONFIG['destination_folder'] + filename
+                destination_path = GCP_CONFIG['destination_folder'] + entry.name
                 
                 blob = self.bucket.blob(destination_path)
-                blob.upload_from_filename(local_file)
+                with entry.open() as f:
+                    blob.upload_from_file(f, size=entry.size, content_type='text/csv')
                 
-                logger.info(f"☁️ Subido a GCP: {filename}")
+                logger.info(f"☁️ Subido a GCP: {entry.name}")
                 results['success'] += 1
-                results['uploaded_files'].append(filename)
+                results['uploaded_files'].append(entry.name)
+                results['transferred_bytes'] += entry.source_size
                 
             except Exception as e:
-                logger.error(f"❌ Error subiendo {local_file}: {str(e)}")
+                logger.error(f"❌ Error subiendo {entry.name}: {str(e)}")
                 results['failed'] += 1
         
         return results
     
+    def compose_blobs(self, sources: List[storage.Blob], destination_name: str,
+                      temp_prefix: str, created: List[storage.Blob]) -> storage.Blob:
+        """Componer objetos en GCS respetando el límite de 32 fuentes por operación"""
+        level = 0
+        while len(sources) > COMPOSE_MAX_SOURCES:
+            # Combinar por bloques en objetos intermedios hasta quedar bajo el límite
+            next_sources = []
+            for i in range(0, len(sources), COMPOSE_MAX_SOURCES):
+                chunk = sources[i:i + COMPOSE_MAX_SOURCES]
+                if len(chunk) == 1:
+                    next_sources.append(chunk[0])
+                    continue
+                intermediate = self.bucket.blob(f"{temp_prefix}compose_{level}_{i // COMPOSE_MAX_SOURCES:04d}")
+                intermediate.content_type = 'text/csv'
+                intermediate.compose(chunk)
+                created.append(intermediate)
+                next_sources.append(intermediate)
+            sources = next_sources
+            level += 1
+        
+        destination = self.bucket.blob(destination_name)
+        destination.content_type = 'text/csv'
+        destination.compose(sources)
+        return destination
+    
+    def start_rollup_day(self, date_str: str, keep_originals: bool, append_existing: bool = False) -> Dict:
+        """Crear el estado del archivo diario combinado de una fecha"""
+        return {
+            'date': date_str,
+            'keep_originals': keep_originals,
+            'append_existing': append_existing,
+            'temp_prefix': f"{GCP_CONFIG['destination_folder']}_rollup_tmp/{date_str}/",
+            'header': None,
+            'header_blob': None,
+            'newline_blob': None,
+            'parts': {},
+            'created': [],
+            'futures': [],
+            'lock': threading.Lock(),
+            'results': {'success': 0, 'failed': 0, 'uploaded_files': [], 'rollup_files': [],
+                        'transferred_bytes': 0}
+        }
+    
+    def set_rollup_header(self, state: Dict, entry: SpoolEntry):
+        """La cabecera del primer archivo define el esquema del día"""
+        state['header'] = entry.read_header()
+        header_blob = self.bucket.blob(f"{state['temp_prefix']}header.csv")
+        header_blob.upload_from_string(state['header'], content_type='text/csv')
+        state['created'].append(header_blob)
+        state['header_blob'] = header_blob
+    
+    def stage_rollup_file(self, state: Dict, index: int, entry: SpoolEntry):
+        """Subir el cuerpo de un archivo (sin cabecera) como parte del archivo diario"""
+        results = state['results']
+        try:
+            with entry.open() as f:
+                if f.readline() != state['header']:
+                    mismatched = True
+                else:
+                    mismatched = False
+                    # Subir solo el cuerpo; la cabecera se agrega en el compose
+                    body_blob = self.bucket.blob(f"{state['temp_prefix']}part_{index:05d}.csv")
+                    body_blob.upload_from_file(f, content_type='text/csv')
+                    state['created'].append(body_blob)
+                    
+                    ends_with_newline = True
+                    if entry.size > len(state['header']):
+                        f.seek(-1, os.SEEK_END)
+                        ends_with_newline = f.read(1) == b'\n'
+            
+            if mismatched:
+                # Un esquema distinto no se mezcla en el archivo diario
+                logger.warning(f"⚠️  {entry.name} tiene una cabecera distinta, se sube por separado")
+                individual = self.upload_to_gcp([entry])
+                with state['lock']:
+                    results['success'] += individual['success']
+                    results['failed'] += individual['failed']
+                    results['uploaded_files'].extend(individual['uploaded_files'])
+                    results['transferred_bytes'] += individual['transferred_bytes']
+                return
+            
+            if state['keep_originals']:
+                original_name = GCP_CONFIG['destination_folder'] + entry.name
+                self.compose_blobs([state['header_blob'], body_blob], original_name,
+                                   state['temp_prefix'], state['created'])
+            
+            with state['lock']:
+                state['parts'][index] = (body_blob, ends_with_newline, entry.name, entry.source_size)
+                results['success'] += 1
+                results['transferred_bytes'] += entry.source_size
+                if state['keep_originals']:
+                    results['uploaded_files'].append(entry.name)
+                    
+        except Exception as e:
+            logger.error(f"❌ Error subiendo parte de {entry.name}: {str(e)}")
+            with state['lock']:
+                results['failed'] += 1
+    
+    def get_newline_blob(self, state: Dict) -> storage.Blob:
+        """Objeto temporal con un salto de línea para separar partes sin salto final"""
+        if state['newline_blob'] is None:
+            newline_blob = self.bucket.blob(f"{state['temp_prefix']}newline.csv")
+            newline_blob.upload_from_string(b'\n', content_type='text/csv')
+            state['created'].append(newline_blob)
+            state['newline_blob'] = newline_blob
+        return state['newline_blob']
+    
+    def keep_parts_as_originals(self, state: Dict):
+        """Publicar cada parte como objeto individual (cabecera + cuerpo)"""
+        if state['keep_originals']:
+            return
+        for index in sorted(state['parts']):
+            body_blob, _, name, _ = state['parts'][index]
+            self.compose_blobs([state['header_blob'], body_blob], GCP_CONFIG['destination_folder'] + name,
+                               state['temp_prefix'], state['created'])
+            state['results']['uploaded_files'].append(name)
+    
+    def finish_rollup_day(self, state: Dict) -> Dict[str, int]:
+        """Combinar las partes de un día en un objeto diario sin cabeceras repetidas"""
+        results = state['results']
+        try:
+            # Esperar a que todas las partes del día estén subidas
+            for future in state['futures']:
+                future.result()
+            
+            if state['parts']:
+                rollup_name = PROCESSING_CONFIG['rollup_object_name'].format(date=state['date'])
+                destination_name = GCP_CONFIG['destination_folder'] + rollup_name
+                sources = [state['header_blob']]
+                
+                if state['append_existing']:
+                    # El descubrimiento incremental solo trae los archivos nuevos del día:
+                    # el archivo diario existente va primero para no perder lo ya combinado
+                    existing = self.bucket.get_blob(destination_name)
+                    if existing is not None:
+                        header = state['header']
+                        if header and existing.download_as_bytes(start=0, end=len(header) - 1) != header:
+                            logger.warning(f"⚠️  {rollup_name} tiene otra cabecera, no se sobrescribe; "
+                                           f"los archivos nuevos se suben por separado")
+                            self.keep_parts_as_originals(state)
+                            return results
+                        sources = [existing]
+                        if existing.size and existing.download_as_bytes(start=existing.size - 1) != b'\n':
+                            sources.append(self.get_newline_blob(state))
+                
+                for index in sorted(state['parts']):
+                    body_blob, ends_with_newline, _, _ = state['parts'][index]
+                    sources.append(body_blob)
+                    if not ends_with_newline:
+                        # Evitar que la última línea se una con la primera del siguiente archivo
+                        sources.append(self.get_newline_blob(state))
+                
+                self.compose_blobs(sources, destination_name, state['temp_prefix'], state['created'])
+                results['rollup_files'].append(rollup_name)
+                logger.info(f"🧩 Archivo diario combinado: {rollup_name} ({len(state['parts'])} archivos)")
+                
+        except Exception as e:
+            logger.error(f"❌ Error combinando archivos del {state['date']}: {str(e)}")
+            if not state['keep_originals']:
+                # Sin originales, las partes no quedaron disponibles en el bucket
+                results['success'] -= len(state['parts'])
+                results['failed'] += len(state['parts'])
+                results['transferred_bytes'] -= sum(part[3] for part in state['parts'].values())
+        finally:
+            self.delete_rollup_temp(state)
+        
+        return results
+    
+    def delete_rollup_temp(self, state: Dict):
+        """Eliminar los objetos temporales (cabecera, partes, intermedios) de un día"""
+        for blob in state['created']:
+            try:
+                blob.delete()
+            except Exception as e:
+                logger.warning(f"⚠️  No se pudo eliminar temporal {blob.name}: {str(e)}")
+        state['created'] = []
+    
+    def discard_rollup_day(self, state: Dict) -> Dict[str, int]:
+        """Abortar un día sin combinar: esperar sus partes en curso y limpiar el bucket"""
+        results = state['results']
+        for future in state['futures']:
+            try:
+                future.result()
+            except Exception:
+                pass
+        logger.warning(f"⚠️  Archivo diario del {state['date']} no combinado, se eliminan temporales")
+        self.delete_rollup_temp(state)
+        if not state['keep_originals']:
+            # Las partes eliminadas no quedaron disponibles en el bucket
+            results['success'] -= len(state['parts'])
+            results['failed'] += len(state['parts'])
+            results['transferred_bytes'] -= sum(part[3] for part in state['parts'].values())
+        return results
+    
+    def process_files(self, files_by_date: Dict[str, List[paramiko.SFTPAttributes]], spool: SpoolManager,
+                      daily_rollup: bool = False, keep_originals: bool = True,
+                      append_existing: bool = False) -> Dict[str, int]:
+        """Descargar, descomprimir y subir archivo por archivo respetando el presupuesto del spool"""
+        results = {'success': 0, 'failed': 0, 'uploaded_files': [], 'rollup_files': [], 'transferred_bytes': 0}
+        results_lock = threading.Lock()
+        
+        def merge(partial):
+            with results_lock:
+                results['success'] += partial['success']
+                results['failed'] += partial['failed']
+                results['uploaded_files'].extend(partial['uploaded_files'])
+                results['rollup_files'].extend(partial.get('rollup_files', []))
+                results['transferred_bytes'] += partial.get('transferred_bytes', 0)
+        
+        def upload_and_release(entry):
+            try:
+                merge(self.upload_to_gcp([entry]))
+            finally:
+                spool.release(entry)
+        
+        def stage_and_release(state, index, entry):
+            try:
+                self.stage_rollup_file(state, index, entry)
+            finally:
+                spool.release(entry)
+        
+        if PROCESSING_CONFIG['transfer_engine'] == 'async':
+            files_by_date = self.process_files_async(files_by_date, spool, daily_rollup, merge)
+        
+        rollup_futures = []
+        with ThreadPoolExecutor(max_workers=PROCESSING_CONFIG['upload_workers']) as uploads, \
+                ThreadPoolExecutor(max_workers=PROCESSING_CONFIG['rollup_max_workers']) as rollups:
+            for date_str, attrs in sorted(files_by_date.items()):
+                state = self.start_rollup_day(date_str, keep_originals, append_existing) if daily_rollup else None
+                handed_off = False
+                
+                try:
+                    for index, attr in enumerate(sorted(attrs, key=lambda a: a.filename)):
+                        # Descargar bloquea si el spool está lleno (backpressure)
+                        try:
+                            entry = self.download_to_spool(attr, spool)
+                        except SpoolError:
+                            raise
+                        except Exception as e:
+                            logger.error(f"❌ Error procesando archivo {attr.filename}: {str(e)}")
+                            merge({'success': 0, 'failed': 1, 'uploaded_files': []})
+                            continue
+                        
+                        if state is None:
+                            uploads.submit(upload_and_release, entry)
+                            continue
+                        
+                        if state['header_blob'] is None:
+                            try:
+                                self.set_rollup_header(state, entry)
+                            except Exception:
+                                spool.release(entry)
+                                raise
+                        state['futures'].append(uploads.submit(stage_and_release, state, index, entry))
+                    
+                    if state is not None:
+                        # Los días se combinan en paralelo mientras continúan las descargas
+                        rollup_futures.append(rollups.submit(self.finish_rollup_day, state))
+                        handed_off = True
+                finally:
+                    if state is not None and not handed_off:
+                        # El día no llegó a combinarse: borrar sus temporales del bucket
+                        merge(self.discard_rollup_day(state))
+            
+            for future in rollup_futures:
+                merge(future.result())
+        
+        return results
+    
+    def process_files_async(self, files_by_date: Dict[str, List[paramiko.SFTPAttributes]], spool: SpoolManager,
+                            daily_rollup: bool, merge) -> Dict[str, List[paramiko.SFTPAttributes]]:
+        """Transferir los archivos pequeños con el motor asíncrono y devolver los pendientes"""
+        if AsyncTransferEngine is None:
+            logger.warning("⚠️  Motor asíncrono no disponible (instala asyncssh y aiohttp), se usan hilos")
+            return files_by_date
+        if daily_rollup:
+            logger.warning("⚠️  El archivo diario combinado usa el motor de hilos")
+            return files_by_date
+        
+        # El motor asíncrono lee cada .gz completo en memoria: los grandes se
+        # descargan en streaming con el motor de hilos
+        threshold = PROCESSING_CONFIG['async_max_file_mb'] * 1024 * 1024
+        small_files = []
+        file_dates = {}
+        remaining = {}
+        for date_str, attrs in sorted(files_by_date.items()):
+            for attr in attrs:
+                if (attr.st_size or 0) <= threshold:
+                    small_files.append(attr)
+                    file_dates[attr.filename] = date_str
+                else:
+                    remaining.setdefault(date_str, []).append(attr)
+        
+        if small_files:
+            logger.info(f"⚡ Motor asíncrono: {len(small_files)} archivos pequeños")
+            engine = AsyncTransferEngine(SFTP_CONFIG, GCP_CONFIG, PROCESSING_CONFIG)
+            results = engine.run(small_files, spool)
+            merge(results)
+            # Archivos cedidos por falta de presupuesto: el motor de hilos los descarga en streaming
+            for attr in results['deferred']:
+                remaining.setdefault(file_dates[attr.filename], []).append(attr)
+        
+        return remaining
+    
     def cleanup(self):
         """Cerrar conexiones"""
         if self.sftp_client:
             self.sftp_client.close()
         logger.info("🔒 Conexiones cerradas")
 
+def get_recent_throughput() -> Optional[Dict[str, float]]:
+    """Calcular el rendimiento medido en las últimas transferencias"""
+    try:
+        with open(PROCESSING_CONFIG['stats_file'], 'r') as f:
+            runs = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    total_bytes = sum(run['bytes'] for run in runs)
+    total_files = sum(run['files'] for run in runs)
+    total_seconds = sum(run['seconds'] for run in runs)
+    if not total_bytes or not total_seconds:
+        return None
+    
+    return {
+        'bytes_per_second': round(total_bytes / total_seconds),
+        'files_per_second': round(total_files / total_seconds, 3),
+        'runs': len(runs)
+    }
+
+def record_throughput(bytes_transferred: int, files: int, seconds: float):
+    """Guardar el rendimiento de una transferencia para estimaciones futuras"""
+    try:
+        with open(PROCESSING_CONFIG['stats_file'], 'r') as f:
+            runs = json.load(f)
+    except (OSError, ValueError):
+        runs = []
+    
+    runs.append({
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'bytes': bytes_transferred,
+        'files': files,
+        'seconds': round(seconds, 3)
+    })
+    runs = runs[-PROCESSING_CONFIG['stats_max_runs']:]
+    
+    try:
+        with open(PROCESSING_CONFIG['stats_file'], 'w') as f:
+            json.dump(runs, f, indent=2)
+    except OSError as e:
+        logger.warning(f"⚠️  No se pudo guardar estadísticas de transferencia: {str(e)}")
+
+def is_explicit_range(options: Dict) -> bool:
+    """El usuario acotó el rango (backfill): se ignora la marca de agua"""
+    return bool(options.get('start_date') or options.get('end_date'))
+
+def resolve_date_range(options: Dict) -> Tuple[datetime, datetime]:
+    """Calcular el rango de fechas pendiente, permitiendo acotarlo desde la petición"""
+    # Obtener última fecha
+    last_date = transfer_manager.get_last_upload_date()
+    if not last_date:
+        # Si no hay archivos, empezar desde hace 7 días
+        last_date = datetime.now() - timedelta(days=7)
+    
+    # Calcular rango de fechas
+    start_date = last_date + timedelta(days=1)
+    end_date = datetime.now() - timedelta(days=1)  # Hasta ayer
+    
+    if options.get('start_date'):
+        start_date = datetime.strptime(options['start_date'], '%Y-%m-%d')
+    if options.get('end_date'):
+        end_date = datetime.strptime(options['end_date'], '%Y-%m-%d')
+    
+    return start_date, end_date
+
+def load_discovery_state() -> Dict:
+    """Leer las marcas de agua del descubrimiento incremental"""
+    try:
+        with open(PROCESSING_CONFIG['discovery_state_file'], 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_discovery_state(state: Dict):
+    """Guardar las marcas de agua del descubrimiento incremental"""
+    try:
+        with open(PROCESSING_CONFIG['discovery_state_file'], 'w') as f:
+            json.dump(state, f, indent=2)
+    except OSError as e:
+        logger.warning(f"⚠️  No se pudo guardar el estado de descubrimiento: {str(e)}")
+
+def advance_watermark(watermark: Optional[Dict], seen: List, pending: List) -> Optional[Dict]:
+    """Avanzar la marca de agua sin saltar archivos nuevos que quedaron fuera del rango"""
+    # `seen` son los seleccionados más la historia anterior al rango; los pendientes
+    # (p. ej. de hoy) deben volver a aparecer
+    limit = min((attr.st_mtime or 0 for attr in pending), default=None)
+    candidates = [attr for attr in seen if limit is None or (attr.st_mtime or 0) < limit]
+    if not candidates:
+        return watermark
+    
+    mtime = max(attr.st_mtime or 0 for attr in candidates)
+    names = {attr.filename for attr in candidates if (attr.st_mtime or 0) == mtime}
+    if watermark and watermark['mtime'] == mtime:
+        names.update(watermark['names'])
+    elif watermark and watermark['mtime'] > mtime:
+        return watermark
+    return {'mtime': mtime, 'names': sorted(names)}
+
 # Instancia global del manager
 transfer_manager = TransferManager()
 
@@ -243,6 +1094,10 @@ def check_status():
 def start_transfer():
     """Iniciar proceso de transferencia"""
     try:
+        options = request.get_json(silent=True) or {}
+        daily_rollup = options.get('daily_rollup', PROCESSING_CONFIG['daily_rollup'])
+        keep_originals = options.get('keep_originals', PROCESSING_CONFIG['rollup_keep_originals'])
+        
         # Conectar a GCP
         if not transfer_manager.connect_gcp():
             return jsonify({
@@ -250,15 +1105,7 @@ def start_transfer():
                 'message': 'Error conectando a GCP'
             })
         
-        # Obtener última fecha
-        last_date = transfer_manager.get_last_upload_date()
-        if not last_date:
-            # Si no hay archivos, empezar desde hace 7 días
-            last_date = datetime.now() - timedelta(days=7)
-        
-        # Calcular rango de fechas
-        start_date = last_date + timedelta(days=1)
-        end_date = datetime.now() - timedelta(days=1)  # Hasta ayer
+        start_date, end_date = resolve_date_range(options)
         
         if start_date > end_date:
             return jsonify({
@@ -275,7 +1122,10 @@ def start_transfer():
             })
         
         # Obtener archivos a descargar
-        files_to_download = transfer_manager.get_files_to_download(start_date, end_date)
+        use_watermark = not is_explicit_range(options)
+        files_by_date = transfer_manager.get_files_to_download(start_date, end_date, use_watermark)
+        remote_files = [attr for attrs in files_by_date.values() for attr in attrs]
+        files_to_download = [attr.filename for attr in remote_files]
         
         if not files_to_download:
             return jsonify({
@@ -284,23 +1134,36 @@ def start_transfer():
                 'files_processed': 0
             })
         
-        # Crear directorio temporal
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Descargar y descomprimir
-            decompressed_files = transfer_manager.download_and_decompress(files_to_download, temp_dir)
-            
-            if not decompressed_files:
-                return jsonify({
-                    'success': False,
-                    'message': 'Error descargando/descomprimiendo archivos'
-                })
-            
-            # Subir a GCP
-            upload_results = transfer_manager.upload_to_gcp(decompressed_files)
+        transfer_started = time.monotonic()
+        
+        # Descargar, descomprimir y subir con presupuesto de memoria/disco
+        with SpoolManager.from_config() as spool:
+            # Con marca de agua solo llegan archivos nuevos: se agregan al archivo diario existente
+            append_existing = use_watermark and PROCESSING_CONFIG['discovery_mode'] == 'incremental'
+            upload_results = transfer_manager.process_files(files_by_date, spool, daily_rollup,
+                                                            keep_originals, append_existing)
+        
+        if not upload_results['success'] and upload_results['failed']:
+            transfer_manager.cleanup()
+            return jsonify({
+                'success': False,
+                'message': 'Error descargando/descomprimiendo archivos'
+            })
         
         # Limpiar conexiones
         transfer_manager.cleanup()
         
+        if not upload_results['failed']:
+            transfer_manager.commit_discovery_state()
+        
+        if upload_results['success']:
+            # Solo cuentan los archivos subidos: los fallidos inflarían el rendimiento
+            record_throughput(
+                upload_results['transferred_bytes'],
+                upload_results['success'],
+                time.monotonic() - transfer_started
+            )
+        
         return jsonify({
             'success': True,
             'message': f'Proceso completado exitosamente',
@@ -308,6 +1171,7 @@ def start_transfer():
             'files_processed': upload_results['success'],
             'files_failed': upload_results['failed'],
             'uploaded_files': upload_results['uploaded_files'],
+            'rollup_files': upload_results.get('rollup_files', []),
             'date_range': f"{start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}"
         })
         
@@ -319,5 +1183,58 @@ def start_transfer():
             'message': f'Error durante la transferencia: {str(e)}'
         })
 
+@app.route('/api/plan_transfer', methods=['POST'])
+def plan_transfer():
+    """Calcular el plan de transferencia (simulación) sin mover archivos"""
+    try:
+        options = request.get_json(silent=True) or {}
+        
+        # Conectar a GCP
+        if not transfer_manager.connect_gcp():
+            return jsonify({
+                'success': False,
+                'message': 'Error conectando a GCP'
+            })
+        
+        start_date, end_date = resolve_date_range(options)
+        date_range = f"{start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}"
+        
+        if start_date > end_date:
+            return jsonify({
+                'success': True,
+                'message': 'No hay archivos pendientes por procesar',
+                'date_range': date_range,
+                'days': [],
+                'totals': {'files': 0, 'compressed_bytes': 0, 'decompressed_bytes': 0},
+                'estimated_seconds': 0
+            })
+        
+        # Conectar a SFTP
+        if not transfer_manager.connect_sftp():
+            return jsonify({
+                'success': False,
+                'message': 'Error conectando a SFTP. Verifica que la VPN esté conectada.'
+            })
+        
+        plan = transfer_manager.build_transfer_plan(start_date, end_date, not is_explicit_range(options))
+        transfer_manager.cleanup()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Plan generado (no se transfirió ningún archivo)',
+            'date_range': date_range,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            **plan
+        })
+        
+    except Exception as e:
+        transfer_manager.cleanup()
+        logger.error(f"Error generando plan: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error generando plan: {str(e)}'
+        })
+
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
@@ -0,0 +1,252 @@
+"""
+Motor de transferencia asíncrono SFTP → GCP
+Pensado para días con miles de archivos pequeños: multiplexa las lecturas
+SFTP sobre pocas sesiones y sube a GCS con un cliente HTTP asíncrono
+"""
+
+import asyncio
+import gzip
+import io
+import logging
+import os
+import posixpath
+from typing import List, Dict
+
+import aiohttp
+import asyncssh
+import google.auth
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+# Igual que google-cloud-storage, STORAGE_EMULATOR_HOST redirige a un emulador local
+STORAGE_EMULATOR_HOST = os.environ.get('STORAGE_EMULATOR_HOST')
+GCS_UPLOAD_URL = (STORAGE_EMULATOR_HOST or 'https://storage.googleapis.com') + '/upload/storage/v1/b/{bucket}/o'
+GCS_SCOPES = ['https://www.googleapis.com/auth/devstorage.read_write']
+
+# Respuestas de GCS que conviene reintentar
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+HTTP_TIMEOUT = aiohttp.ClientTimeout(sock_connect=30, sock_read=120)
+
+
+class AsyncTransferEngine:
+    def __init__(self, sftp_config: Dict, gcp_config: Dict, processing_config: Dict):
+        self.sftp_config = sftp_config
+        self.gcp_config = gcp_config
+        self.processing_config = processing_config
+        self.credentials = None
+        self.token_lock = None
+        self.budget_condition = None
+        self.waiting_buffers = 0
+
+    def load_credentials(self):
+        """Cargar credenciales de GCP (service account o credenciales por defecto)"""
+        if STORAGE_EMULATOR_HOST:
+            return
+        if os.path.exists(self.gcp_config['service_account_path']):
+            self.credentials = service_account.Credentials.from_service_account_file(
+                self.gcp_config['service_account_path'], scopes=GCS_SCOPES
+            )
+        else:
+            self.credentials, _ = google.auth.default(scopes=GCS_SCOPES)
+
+    async def get_auth_headers(self) -> Dict[str, str]:
+        """Cabecera de autorización con un token vigente (ninguna contra el emulador)"""
+        if STORAGE_EMULATOR_HOST:
+            return {}
+        return {'Authorization': f"Bearer {await self.get_access_token()}"}
+
+    async def get_access_token(self) -> str:
+        """Obtener un token vigente, renovándolo fuera del event loop"""
+        async with self.token_lock:
+            if not self.credentials.valid:
+                await asyncio.to_thread(self.credentials.refresh, Request())
+            return self.credentials.token
+
+    async def open_sftp_sessions(self, count: int) -> List:
+        """Abrir varias sesiones SFTP; cada una admite muchas peticiones en paralelo"""
+        sessions = []
+        for _ in range(count):
+            # Igual que el cliente paramiko actual, no se valida la clave del host
+            connection = await asyncssh.connect(
+                self.sftp_config['hostname'],
+                port=self.sftp_config['port'],
+                username=self.sftp_config['username'],
+                password=self.sftp_config['password'],
+                known_hosts=None
+            )
+            sftp = await connection.start_sftp_client()
+            sessions.append((connection, sftp))
+        logger.info(f"✅ {count} sesiones SFTP asíncronas establecidas")
+        return sessions
+
+    async def reserve(self, spool, name: str, size: int, allow_disk: bool = True):
+        """Reservar presupuesto del spool esperando en el event loop, sin bloquear hilos"""
+        async with self.budget_condition:
+            while True:
+                entry = spool.try_reserve(name, size, allow_disk)
+                if entry is not None:
+                    return entry
+                try:
+                    # El tiempo límite vuelve a comprobar el espacio libre en disco
+                    await asyncio.wait_for(self.budget_condition.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def reserve_entry(self, spool, name: str, size: int):
+        """Reservar el archivo descomprimido mientras la tarea retiene su .gz en memoria.
+        Devuelve None si solo quedan en vuelo buffers de tareas que también esperan:
+        ninguno se liberaría y esperar bloquearía la transferencia para siempre"""
+        async with self.budget_condition:
+            while True:
+                entry = spool.try_reserve(name, size)
+                if entry is not None:
+                    return entry
+                with spool.condition:
+                    in_flight = len(spool.entries)
+                # Las entradas en vuelo incluyen el buffer propio
+                if in_flight <= self.waiting_buffers + 1:
+                    return None
+                self.waiting_buffers += 1
+                try:
+                    await asyncio.wait_for(self.budget_condition.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.waiting_buffers -= 1
+    
+    async def notify_budget(self):
+        """Despertar a las tareas que esperan presupuesto"""
+        async with self.budget_condition:
+            self.budget_condition.notify_all()
+
+    async def release(self, spool, entry):
+        spool.release(entry)
+        await self.notify_budget()
+
+    async def upload_entry(self, http: aiohttp.ClientSession, entry) -> None:
+        """Subir una entrada del spool a GCS con una sola petición (uploadType=media)"""
+        url = GCS_UPLOAD_URL.format(bucket=self.gcp_config['bucket_name'])
+        params = {'uploadType': 'media', 'name': self.gcp_config['destination_folder'] + entry.name}
+        retries = self.processing_config['async_upload_retries']
+
+        for attempt in range(retries + 1):
+            try:
+                headers = {'Content-Type': 'text/csv', **await self.get_auth_headers()}
+                with entry.open() as body:
+                    async with http.post(url, params=params, data=body, headers=headers) as response:
+                        if response.status < 300:
+                            return
+                        message = await response.text()
+
+                error = RuntimeError(f"GCS respondió {response.status}: {message[:200]}")
+                if response.status not in RETRYABLE_STATUS:
+                    raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Conexiones cortadas o sin respuesta también se reintentan
+                error = e
+
+            if attempt == retries:
+                raise error
+            await asyncio.sleep(2 ** attempt)
+
+    async def transfer_file(self, sftp, http: aiohttp.ClientSession, attr, spool,
+                            semaphore: asyncio.Semaphore, results: Dict):
+        """Descargar, descomprimir y subir un archivo.
+        Los errores del spool (SpoolError) no se cuentan por archivo: detienen la ejecución"""
+        csv_filename = attr.object_name
+        remote_path = posixpath.join(self.sftp_config['remote_directory'], attr.filename)
+        
+        async with semaphore:
+            buffer_entry = None
+            entry = None
+            try:
+                # El .gz se lee completo en memoria: se cobra al presupuesto antes de leerlo
+                buffer_entry = await self.reserve(spool, attr.filename, attr.st_size or 0, allow_disk=False)
+                try:
+                    async with sftp.open(remote_path, 'rb') as remote_file:
+                        compressed = await remote_file.read()
+                except Exception as e:
+                    self.record_failure(attr, e, results)
+                    return
+                
+                # El trailer ISIZE ya está en memoria: no hace falta otra lectura.
+                # Es módulo 2^32, así que nunca se reserva menos que el comprimido
+                isize = int.from_bytes(compressed[-4:], 'little') if len(compressed) >= 18 else 0
+                entry = await self.reserve_entry(spool, csv_filename, max(isize, len(compressed)))
+                if entry is None:
+                    # Liberar el buffer desbloquea a las demás tareas; el motor de hilos
+                    # descarga este archivo después, en streaming
+                    logger.info(f"⏳ Presupuesto de spool lleno, {attr.filename} pasa al motor de hilos")
+                    results['deferred'].append(attr)
+                    return
+                entry.source_size = attr.st_size or 0
+                
+                try:
+                    await asyncio.to_thread(entry.write_from, gzip.GzipFile(fileobj=io.BytesIO(compressed), mode='rb'))
+                    spool.commit(entry)
+                    del compressed
+                    await self.release(spool, buffer_entry)
+                    buffer_entry = None
+                    
+                    await self.upload_entry(http, entry)
+                except Exception as e:
+                    self.record_failure(attr, e, results)
+                    return
+                
+                logger.info(f"☁️ Subido a GCP: {csv_filename}")
+                results['success'] += 1
+                results['uploaded_files'].append(csv_filename)
+                results['transferred_bytes'] += entry.source_size
+                
+            finally:
+                for reserved in (buffer_entry, entry):
+                    if reserved is not None:
+                        await self.release(spool, reserved)
+    
+    @staticmethod
+    def record_failure(attr, error: Exception, results: Dict):
+        logger.error(f"❌ Error procesando archivo {attr.filename}: {str(error)}")
+        results['failed'] += 1
+    
+    async def transfer_all(self, files: List, spool) -> Dict[str, int]:
+        """Transferir todos los archivos con concurrencia acotada por semáforo"""
+        results = {'success': 0, 'failed': 0, 'uploaded_files': [], 'transferred_bytes': 0, 'deferred': []}
+        self.token_lock = asyncio.Lock()
+        self.budget_condition = asyncio.Condition()
+        await asyncio.to_thread(self.load_credentials)
+
+        session_count = max(1, min(self.processing_config['async_sftp_sessions'], len(files)))
+        semaphore = asyncio.Semaphore(self.processing_config['async_max_in_flight'])
+        connector = aiohttp.TCPConnector(limit=self.processing_config['async_http_connections'])
+
+        sessions = await self.open_sftp_sessions(session_count)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT) as http:
+                tasks = [
+                    asyncio.create_task(
+                        self.transfer_file(sessions[i % session_count][1], http, attr, spool, semaphore, results)
+                    )
+                    for i, attr in enumerate(files)
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    # Un error del spool detiene la ejecución: cancelar las tareas restantes
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+        finally:
+            for connection, sftp in sessions:
+                sftp.exit()
+                connection.close()
+            logger.info("🔒 Sesiones SFTP asíncronas cerradas")
+
+        return results
+
+    def run(self, files: List, spool) -> Dict[str, int]:
+        """Ejecutar la transferencia desde código síncrono (petición Flask)"""
+        return asyncio.run(self.transfer_all(files, spool))
@@ -0,0 +1,200 @@
+"""
+Benchmark de motores de transferencia (hilos vs asíncrono)
+Levanta un servidor SFTP local y un emulador mínimo de subida a GCS con
+latencia simulada, genera muchos .gz pequeños y mide archivos por segundo
+
+Uso: python benchmark_transfer.py --files 2000 --latency-ms 20
+Requiere asyncssh y aiohttp (motor asíncrono)
+"""
+
+import argparse
+import asyncio
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import multiprocessing
+import time
+from datetime import datetime
+from typing import Tuple
+
+import asyncssh
+from aiohttp import web
+
+BUCKET = 'benchmark'
+BENCH_DATE = '20250101'
+
+
+class AcceptAllServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+def create_files(directory: str, count: int, rows: int):
+    """Generar `count` CSV comprimidos pequeños con fecha en el nombre"""
+    body = ''.join(f"{i},cliente_{i},{i * 7 % 1000}\n" for i in range(rows))
+    content = gzip.compress(('id,cliente,monto\n' + body).encode())
+    for i in range(count):
+        with open(os.path.join(directory, f"reporte_{BENCH_DATE}_{i:06d}.csv.gz"), 'wb') as f:
+            f.write(content)
+
+
+async def delayed_pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float):
+    """Reenviar bytes en orden, entregando cada bloque `delay` segundos después"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            due, data = await queue.get()
+            await asyncio.sleep(max(0, due - loop.time()))
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    delivery = asyncio.create_task(deliver())
+    try:
+        while True:
+            data = await reader.read(65536)
+            queue.put_nowait((loop.time() + delay, data))
+            if not data:
+                break
+    except ConnectionError:
+        queue.put_nowait((loop.time(), b''))
+    await delivery
+
+
+async def start_latency_proxy(target_port: int, latency: float) -> int:
+    """Proxy TCP con latencia de red simulada (RTT = `latency`), sin serializar peticiones"""
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection('127.0.0.1', target_port)
+        await asyncio.gather(
+            delayed_pipe(client_reader, server_writer, latency / 2),
+            delayed_pipe(server_reader, client_writer, latency / 2),
+            return_exceptions=True
+        )
+
+    proxy = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return proxy.sockets[0].getsockname()[1]
+
+
+async def start_servers(sftp_root: str, latency: float):
+    """Iniciar el servidor SFTP y el emulador de GCS detrás de proxies con latencia"""
+    async def upload(request):
+        await request.read()
+        name = request.query.get('name', 'objeto')
+        return web.json_response({'bucket': BUCKET, 'name': name, 'generation': '1', 'size': '0'})
+
+    gcs_app = web.Application(client_max_size=1024 ** 3)
+    gcs_app.router.add_post('/upload/storage/v1/b/{bucket}/o', upload)
+    runner = web.AppRunner(gcs_app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    gcs_port = runner.addresses[0][1]
+
+    sftp_server = await asyncssh.listen(
+        '127.0.0.1', 0,
+        server_host_keys=[asyncssh.generate_private_key('ssh-ed25519')],
+        server_factory=AcceptAllServer,
+        sftp_factory=lambda chan: asyncssh.SFTPServer(chan, chroot=sftp_root)
+    )
+    sftp_port = sftp_server.sockets[0].getsockname()[1]
+    return await start_latency_proxy(sftp_port, latency), await start_latency_proxy(gcs_port, latency)
+
+
+def serve_forever(sftp_root: str, latency: float, ports: multiprocessing.Queue):
+    """Proceso servidor: así no compite por el GIL con el cliente medido"""
+    loop = asyncio.new_event_loop()
+    ports.put(loop.run_until_complete(start_servers(sftp_root, latency)))
+    loop.run_forever()
+
+
+def run_servers_in_background(sftp_root: str, latency: float) -> Tuple[multiprocessing.Process, Tuple[int, int]]:
+    """Ejecutar los servidores en un proceso aparte y devolver sus puertos"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_forever, args=(sftp_root, latency, ports), daemon=True)
+    process.start()
+    return process, ports.get(timeout=30)
+
+
+def run_engine(app, engine: str, spool_dir: str) -> float:
+    """Transferir todos los archivos con el motor indicado y devolver archivos/s"""
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+
+    app.PROCESSING_CONFIG['transfer_engine'] = engine
+    app.PROCESSING_CONFIG['temp_directory'] = spool_dir
+
+    manager = app.TransferManager()
+    manager.gcp_client = storage.Client(project='benchmark', credentials=AnonymousCredentials())
+    manager.bucket = manager.gcp_client.bucket(BUCKET)
+    if not manager.connect_sftp():
+        sys.exit("❌ No se pudo conectar al SFTP local")
+
+    bench_date = datetime.strptime(BENCH_DATE, '%Y%m%d')
+    files_by_date = manager.get_files_to_download(bench_date, bench_date)
+    total = sum(len(attrs) for attrs in files_by_date.values())
+
+    started = time.monotonic()
+    with app.SpoolManager.from_config() as spool:
+        results = manager.process_files(files_by_date, spool)
+    elapsed = time.monotonic() - started
+    manager.sftp_client.get_channel().get_transport().close()
+    manager.cleanup()
+
+    if results['success'] != total:
+        sys.exit(f"❌ Motor {engine}: {results['success']}/{total} archivos subidos, {results['failed']} fallidos")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000, help='Cantidad de archivos .gz')
+    parser.add_argument('--rows', type=int, default=50, help='Filas por CSV')
+    parser.add_argument('--latency-ms', type=float, default=20, help='RTT de red simulado hacia SFTP y GCS')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_sftp_')
+    try:
+        sftp_root = os.path.join(work_dir, 'remoto')
+        os.makedirs(sftp_root)
+        create_files(sftp_root, args.files, args.rows)
+
+        server_process, (sftp_port, gcs_port) = run_servers_in_background(sftp_root, args.latency_ms / 1000)
+
+        # Debe definirse antes de importar app/async_transfer
+        os.environ['STORAGE_EMULATOR_HOST'] = f"http://127.0.0.1:{gcs_port}"
+        import logging
+        import app
+        logging.getLogger().setLevel(logging.WARNING)
+
+        app.SFTP_CONFIG.update({
+            'hostname': '127.0.0.1', 'port': sftp_port,
+            'username': 'benchmark', 'password': 'benchmark', 'remote_directory': '/'
+        })
+        app.GCP_CONFIG.update({'bucket_name': BUCKET})
+        app.PROCESSING_CONFIG.update({'discovery_mode': 'full', 'date_subdirectory_format': None})
+
+        print(f"📦 {args.files} archivos, RTT simulado {args.latency_ms} ms")
+        threaded = run_engine(app, 'threads', os.path.join(work_dir, 'spool_hilos'))
+        print(f"🧵 Motor de hilos:    {threaded:8.1f} archivos/s")
+        asynchronous = run_engine(app, 'async', os.path.join(work_dir, 'spool_async'))
+        print(f"⚡ Motor asíncrono:   {asynchronous:8.1f} archivos/s")
+        print(f"📊 Mejora: {asynchronous / threaded:.1f}x")
+        server_process.terminate()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()